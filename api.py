@@ -0,0 +1,627 @@
+"""Headless HTTP API for DocPro-Ai.
+
+Exposes authentication, follow-up question generation, diagnosis (optionally
+streamed), re-rendering of an existing analysis in another language/mode and
+Health Vault operations without Streamlit, so partner systems can call them
+directly. The service is stateless apart from the shared SQLite
+database and signed bearer tokens, so several instances can run behind a load
+balancer as long as they share API_SECRET.
+
+Run with:  python api.py --port 8080
+Locally:   python api.py --fake-model   (no Gemini key needed)
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from database import Database
+from prompts import (
+    MEDICAL_SYSTEM_PROMPT,
+    MODEL_NAME,
+    GENERATION_SETTINGS,
+    create_diagnosis_prompt,
+    create_rendering_prompt,
+    create_follow_up_questions,
+    can_render,
+    get_analysis_hash,
+    parse_follow_up_questions,
+)
+
+MAX_CONCURRENT_MODEL_CALLS = int(os.environ.get('MAX_CONCURRENT_MODEL_CALLS', 8))
+MODEL_TIMEOUT_SECONDS = 120
+# Large enough for base64-encoded image and lab report attachments
+MAX_BODY_BYTES = 32 * 1024 * 1024
+REQUEST_TIMEOUT_SECONDS = 30
+TOKEN_TTL_SECONDS = 12 * 60 * 60
+RENDERING_CACHE_SIZE = 256
+ANALYSIS_CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    409: 'Conflict',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error',
+    502: 'Bad Gateway',
+    504: 'Gateway Timeout',
+}
+
+
+class ApiError(Exception):
+    """Error that is returned to the client as a JSON error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FakeResponse:
+    """Minimal stand-in for a Gemini response chunk"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Offline model for local testing; answers with canned text and valid follow-up JSON"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+
+    def _answer(self, prompt):
+        if 'Format as JSON' in prompt:
+            return json.dumps({'questions': [
+                {'question': 'When did the symptoms start?', 'options': ['Today', 'This week', 'This month', 'Longer']},
+                {'question': 'How severe are they?', 'options': ['Mild', 'Moderate', 'Severe']},
+            ]})
+        return f"FAKE ANALYSIS ({len(prompt)} prompt chars)\n\n⚠️ DISCLAIMER: This is a fake model response."
+
+    async def generate_content_async(self, contents, stream=False):
+        await asyncio.sleep(self.delay)
+        text = self._answer(contents if isinstance(contents, str) else contents[0])
+        if not stream:
+            return FakeResponse(text)
+
+        async def chunks():
+            for line in text.splitlines(keepends=True):
+                await asyncio.sleep(self.delay)
+                yield FakeResponse(line)
+        return chunks()
+
+
+def create_gemini_model(api_key):
+    """Create the Gemini model with the same configuration as the Streamlit app"""
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(
+        model_name=MODEL_NAME,
+        generation_config=genai.GenerationConfig(**GENERATION_SETTINGS),
+        system_instruction=MEDICAL_SYSTEM_PROMPT
+    )
+
+
+def report_to_dict(report):
+    """Convert a health_reports row into a JSON-serialisable dict"""
+    report_id, user_id, category, symptoms, diagnosis, created_at = report
+    return {
+        'id': report_id,
+        'category': category,
+        'symptoms': symptoms,
+        'diagnosis': diagnosis,
+        'created_at': created_at,
+        # Archived reports are listed as stubs; GET /vault/reports/<id> loads the body
+        'archived': diagnosis is None,
+    }
+
+
+class ApiService:
+    """Request handlers for the HTTP API, independent of the transport"""
+
+    def __init__(self, db, model, secret, max_concurrent_calls=MAX_CONCURRENT_MODEL_CALLS):
+        self.db = db
+        self.model = model
+        self.secret = secret.encode()
+        self.model_slots = asyncio.Semaphore(max_concurrent_calls)
+        self.renderings = OrderedDict()
+        # analysis hash -> (text, language, mode) for POST /render by hash
+        self.analyses = OrderedDict()
+        # PDF extraction pool, created on the first request with lab reports
+        self.pdf_pool = None
+
+    # --- Auth tokens ---
+
+    def create_token(self, user_id):
+        """Create a signed bearer token that any instance sharing the secret can verify"""
+        payload = f"{user_id}.{int(time.time()) + TOKEN_TTL_SECONDS}"
+        signature = hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+        return f"{payload}.{signature}"
+
+    def verify_token(self, token):
+        """Return the user id for a valid token, or raise ApiError"""
+        try:
+            user_id, expires, signature = token.split('.')
+            payload = f"{user_id}.{expires}"
+            expected = hmac.new(self.secret, payload.encode(), hashlib.sha256).hexdigest()
+            # Compare bytes: compare_digest rejects non-ASCII str arguments
+            if hmac.compare_digest(signature.encode(), expected.encode()) and int(expires) > time.time():
+                return int(user_id)
+        except ValueError:
+            pass
+        raise ApiError(401, 'Invalid or expired token')
+
+    def authorize(self, headers):
+        """Get the user id from the Authorization header"""
+        auth = headers.get('authorization', '')
+        if not auth.startswith('Bearer '):
+            raise ApiError(401, 'Missing bearer token')
+        return self.verify_token(auth[len('Bearer '):])
+
+    # --- Model calls ---
+
+    async def generate(self, prompt, images=None):
+        """Run a non-blocking model call under the concurrency limit"""
+        contents = [prompt, *images] if images else prompt
+        async with self.model_slots:
+            try:
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(contents), MODEL_TIMEOUT_SECONDS
+                )
+                return response.text
+            except asyncio.TimeoutError:
+                raise ApiError(504, 'Model call timed out')
+            except Exception as e:
+                raise ApiError(502, f"Error during analysis: {str(e)}")
+
+    async def generate_stream(self, prompt, images=None, on_complete=None):
+        """Stream a model call chunk by chunk under the concurrency limit
+
+        on_complete is called with the full text once the stream finished
+        without errors.
+        """
+        contents = [prompt, *images] if images else prompt
+        async with self.model_slots:
+            try:
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(contents, stream=True), MODEL_TIMEOUT_SECONDS
+                )
+                chunks = []
+                stream = aiter(response)
+                while True:
+                    try:
+                        # Bound every chunk, so a stalled stream can't hold a model slot forever
+                        chunk = await asyncio.wait_for(anext(stream), MODEL_TIMEOUT_SECONDS)
+                    except StopAsyncIteration:
+                        break
+                    chunks.append(chunk.text)
+                    yield chunk.text
+                if on_complete:
+                    on_complete("".join(chunks))
+            except asyncio.TimeoutError:
+                yield "\n\nError during analysis: model call timed out"
+            except Exception as e:
+                yield f"\n\nError during analysis: {str(e)}"
+
+    def remember_analysis(self, analysis, language, mode):
+        """Keep a generated analysis so it can be re-rendered by hash; returns the hash"""
+        analysis_hash = get_analysis_hash(analysis)
+        self.analyses[analysis_hash] = (analysis, language, mode)
+        self.analyses.move_to_end(analysis_hash)
+        if len(self.analyses) > ANALYSIS_CACHE_SIZE:
+            self.analyses.popitem(last=False)
+        return analysis_hash
+
+    async def render(self, analysis, source, mode, language):
+        """Render an analysis generated in `source` (language, mode) for another language and mode"""
+        if (language, mode) == source:
+            return analysis
+        if not can_render(source[1], mode):
+            raise ApiError(409, 'A patient-mode analysis cannot be rendered in doctor mode; '
+                                'request a doctor-mode diagnosis instead')
+
+        cache_key = (get_analysis_hash(analysis), language, mode)
+        if cache_key in self.renderings:
+            self.renderings.move_to_end(cache_key)
+            return self.renderings[cache_key]
+
+        rendering = await self.generate(create_rendering_prompt(analysis, mode, language))
+        self.renderings[cache_key] = rendering
+        if len(self.renderings) > RENDERING_CACHE_SIZE:
+            self.renderings.popitem(last=False)
+        return rendering
+
+    # --- Handlers ---
+
+    async def login(self, body):
+        user = await asyncio.to_thread(
+            self.db.authenticate_user, parse_string(body, 'username'), parse_string(body, 'password')
+        )
+        if not user:
+            raise ApiError(401, 'Invalid credentials')
+        return {'token': self.create_token(user[0]), 'user_id': user[0], 'username': user[1]}
+
+    async def follow_ups(self, body):
+        symptoms = parse_string(body, 'symptoms')
+        language = parse_language(body)
+        if not symptoms:
+            raise ApiError(400, 'symptoms is required')
+
+        response = await self.generate(create_follow_up_questions(symptoms, language))
+        try:
+            questions = parse_follow_up_questions(response)
+        except ValueError:
+            questions = None
+        return {'questions': questions or []}
+
+    async def prepare_attachments(self, body, symptoms):
+        """Preprocess base64 image/lab report attachments like the Streamlit upload flow
+
+        Returns (symptoms plus lab text, image parts, notes).
+        """
+        images = parse_attachments(body, 'images')
+        pdfs = parse_attachments(body, 'lab_reports')
+        keep_duplicates = body.get('keep_duplicates', False)
+        if not isinstance(keep_duplicates, bool):
+            raise ApiError(400, 'keep_duplicates must be true or false')
+        if not images and not pdfs:
+            return symptoms, [], []
+
+        # Imported lazily so text-only deployments don't load Pillow/PyPDF2
+        from preprocessing import preprocess_uploads, pack_payload, create_process_pool
+
+        pool = self.pdf_pool
+        if pdfs and pool is None:
+            pool = self.pdf_pool = create_process_pool()
+        prepared = await asyncio.to_thread(preprocess_uploads, images, pdfs, pool)
+        if prepared['pool_broken']:
+            pool.shutdown(wait=False)
+            # Concurrent requests may have replaced the broken pool already
+            if self.pdf_pool is pool:
+                self.pdf_pool = None
+        duplicates = prepared['duplicates']
+        kept = [duplicate for duplicate, _ in duplicates] if keep_duplicates else []
+        full_input, image_parts, notes = pack_payload(prepared, symptoms, keep_duplicates=kept)
+        notes += [f"{duplicate} looks identical to {original} and was skipped"
+                  for duplicate, original in duplicates if duplicate not in kept]
+        notes += [f"{name}: {error}" for name, error in prepared['errors']]
+        return full_input, image_parts, notes
+
+    async def build_diagnosis(self, body):
+        """Validate a diagnosis request; returns (prompt, image parts, notes, language, mode)"""
+        language, mode = parse_language(body), parse_mode(body)
+        symptoms, image_parts, notes = await self.prepare_attachments(body, parse_string(body, 'symptoms'))
+        if not symptoms and not image_parts:
+            raise ApiError(400, 'symptoms or attachments are required')
+
+        follow_up_answers = body.get('follow_up_answers', {})
+        if not isinstance(follow_up_answers, dict) or not all(
+            isinstance(v, str) for v in follow_up_answers.values()
+        ):
+            raise ApiError(400, 'follow_up_answers must be an object of question: answer strings')
+        follow_up_text = "\n".join([f"Q: {q}\nA: {a}" for q, a in follow_up_answers.items()])
+
+        prompt = create_diagnosis_prompt(
+            symptoms,
+            follow_up_text,
+            parse_string(body, 'medications'),
+            mode,
+            language
+        )
+        return prompt, image_parts, notes, language, mode
+
+    async def diagnose(self, body):
+        prompt, image_parts, notes, language, mode = await self.build_diagnosis(body)
+        result = await self.generate(prompt, image_parts)
+        return {
+            'result': result,
+            'analysis_hash': self.remember_analysis(result, language, mode),
+            'language': language,
+            'mode': mode,
+            'notes': notes,
+        }
+
+    async def diagnose_stream(self, body):
+        """Stream the diagnosis; the finished text can be re-rendered via POST /render"""
+        prompt, image_parts, notes, language, mode = await self.build_diagnosis(body)
+        return self.generate_stream(
+            prompt, image_parts,
+            on_complete=lambda text: self.remember_analysis(text, language, mode)
+        )
+
+    async def render_analysis(self, body):
+        """Re-render an earlier analysis, given its text or hash, in another language/mode"""
+        language, mode = parse_language(body), parse_mode(body)
+        analysis = parse_string(body, 'analysis')
+        if analysis:
+            source = (parse_language(body, 'source_language'), parse_mode(body, 'source_mode'))
+        else:
+            analysis_hash = parse_string(body, 'analysis_hash')
+            if not analysis_hash:
+                raise ApiError(400, 'analysis or analysis_hash is required')
+            if analysis_hash not in self.analyses:
+                # Another instance may have produced it; clients can resend the text
+                raise ApiError(404, 'Unknown analysis_hash; send the analysis text instead')
+            analysis, *source = self.analyses[analysis_hash]
+            source = tuple(source)
+
+        result = await self.render(analysis, source, mode, language)
+        return {
+            'result': result,
+            'analysis_hash': get_analysis_hash(analysis),
+            'language': language,
+            'mode': mode,
+        }
+
+    async def list_reports(self, user_id, query):
+        search = query.get('q', [''])[0]
+        if search:
+            reports = await asyncio.to_thread(self.db.search_user_reports, user_id, search)
+        else:
+            reports = await asyncio.to_thread(self.db.get_user_reports, user_id)
+        category = query.get('category', [''])[0]
+        if category:
+            reports = [r for r in reports if r[2] == category]
+        return {'reports': [report_to_dict(r) for r in reports]}
+
+    async def get_report(self, user_id, report_id):
+        report = await asyncio.to_thread(self.db.get_report_by_id, report_id, user_id)
+        if not report:
+            raise ApiError(404, 'Report not found')
+        return report_to_dict(report)
+
+    async def delete_report(self, user_id, report_id):
+        await self.get_report(user_id, report_id)
+        await asyncio.to_thread(self.db.delete_report, report_id, user_id)
+        return {'deleted': report_id}
+
+    async def dispatch(self, method, path, query, headers, body):
+        """Route a request; returns a dict for JSON responses or an async iterator for streams"""
+        parts = [p for p in path.split('/') if p]
+
+        if parts == ['health']:
+            return {'status': 'ok'}
+        if parts == ['auth', 'login']:
+            require_method(method, 'POST')
+            return await self.login(body)
+
+        user_id = self.authorize(headers)
+
+        if parts == ['follow-ups']:
+            require_method(method, 'POST')
+            return await self.follow_ups(body)
+        if parts == ['diagnose']:
+            require_method(method, 'POST')
+            if body.get('stream'):
+                return await self.diagnose_stream(body)
+            return await self.diagnose(body)
+        if parts == ['render']:
+            require_method(method, 'POST')
+            return await self.render_analysis(body)
+        if parts == ['vault', 'reports']:
+            require_method(method, 'GET')
+            return await self.list_reports(user_id, query)
+        if len(parts) == 3 and parts[:2] == ['vault', 'reports']:
+            try:
+                report_id = int(parts[2])
+            except ValueError:
+                raise ApiError(404, 'Report not found')
+            if method == 'GET':
+                return await self.get_report(user_id, report_id)
+            if method == 'DELETE':
+                return await self.delete_report(user_id, report_id)
+            raise ApiError(405, f"{method} not allowed")
+
+        raise ApiError(404, 'Not found')
+
+
+def require_method(method, expected):
+    if method != expected:
+        raise ApiError(405, f"{method} not allowed")
+
+
+def parse_string(body, key):
+    value = body.get(key) or ''
+    if not isinstance(value, str):
+        raise ApiError(400, f"{key} must be a string")
+    return value
+
+
+def parse_attachments(body, key):
+    """Decode a list of {"name", "data" (base64)} attachments into (name, bytes)"""
+    attachments = body.get(key) or []
+    if not isinstance(attachments, list):
+        raise ApiError(400, f"{key} must be a list")
+    decoded = []
+    for i, attachment in enumerate(attachments):
+        if not isinstance(attachment, dict) or not isinstance(attachment.get('data'), str):
+            raise ApiError(400, f"{key}[{i}] must be an object with base64 data")
+        try:
+            data = base64.b64decode(attachment['data'], validate=True)
+        except (binascii.Error, ValueError):
+            raise ApiError(400, f"{key}[{i}].data is not valid base64")
+        decoded.append((str(attachment.get('name') or f"{key}-{i + 1}"), data))
+    return decoded
+
+
+def parse_language(body, key='language'):
+    language = body.get(key, 'en')
+    if language not in ('en', 'hi', 'hinglish'):
+        raise ApiError(400, f"Unsupported language: {language}")
+    return language
+
+
+def parse_mode(body, key='mode'):
+    mode = body.get(key, 'patient')
+    if mode not in ('patient', 'doctor'):
+        raise ApiError(400, f"Unsupported mode: {mode}")
+    return mode
+
+
+# --- HTTP transport ---
+
+async def read_line(reader):
+    try:
+        return await reader.readline()
+    except (asyncio.LimitOverrunError, ValueError):
+        # The line is longer than the stream buffer limit
+        raise ApiError(431, 'Request line or header too long')
+
+
+async def read_request(reader):
+    """Read an HTTP/1.1 request; returns (method, target, headers, body)"""
+    request_line = (await read_line(reader)).decode('latin-1').strip()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.split(' ', 2)
+    except ValueError:
+        raise ApiError(400, 'Malformed request line')
+
+    headers = {}
+    while True:
+        line = await read_line(reader)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise ApiError(400, 'Invalid Content-Length')
+    if length < 0:
+        raise ApiError(400, 'Invalid Content-Length')
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, 'Request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+def write_head(writer, status, headers):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+
+async def write_json(writer, status, payload):
+    data = json.dumps(payload, ensure_ascii=False).encode()
+    write_head(writer, status, {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Content-Length': len(data),
+        'Connection': 'close',
+    })
+    writer.write(data)
+    await writer.drain()
+
+
+async def write_stream(writer, chunks):
+    write_head(writer, 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Transfer-Encoding': 'chunked',
+        'Connection': 'close',
+    })
+    async for text in chunks:
+        data = text.encode()
+        if data:
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def make_handler(service):
+    """Create the asyncio connection handler for a service"""
+
+    async def handle(reader, writer):
+        try:
+            try:
+                # Don't let idle or slow clients hold a connection forever
+                request = await asyncio.wait_for(read_request(reader), REQUEST_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                raise ApiError(408, 'Timed out reading request')
+            if request is None:
+                return
+            method, target, headers, raw_body = request
+            url = urlsplit(target)
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except ValueError:
+                raise ApiError(400, 'Body must be JSON')
+            if not isinstance(body, dict):
+                raise ApiError(400, 'Body must be a JSON object')
+
+            result = await service.dispatch(method, url.path, parse_qs(url.query), headers, body)
+            if isinstance(result, dict):
+                await write_json(writer, 200, result)
+            else:
+                await write_stream(writer, result)
+        except ApiError as e:
+            await write_json(writer, e.status, {'error': e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            # Details stay in the server log
+            logger.exception('Unhandled error serving request')
+            await write_json(writer, 500, {'error': 'Internal server error'})
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    """Start the HTTP server and serve forever"""
+    server = await asyncio.start_server(make_handler(service), host, port)
+    # Archive old reports and vacuum; runs are claimed across instances
+    threading.Thread(target=service.db.run_maintenance_forever, daemon=True).start()
+    print(f"DocPro-Ai API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DocPro-Ai headless HTTP API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db', default='cdss_health_vault.db')
+    parser.add_argument('--fake-model', action='store_true', help="Use an offline fake model")
+    args = parser.parse_args()
+
+    secret = os.environ.get('API_SECRET')
+    if not secret:
+        # Tokens from a random secret only validate on this instance
+        print("API_SECRET not set; generating one (tokens won't work across instances)")
+        secret = secrets.token_hex(32)
+
+    if args.fake_model:
+        model = FakeModel()
+    else:
+        model = create_gemini_model(os.environ['GOOGLE_API_KEY'])
+
+    async def run():
+        await serve(ApiService(Database(args.db), model, secret), args.host, args.port)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
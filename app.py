@@ -1,13 +1,25 @@
 import streamlit as st
 import google.generativeai as genai
 from datetime import datetime
-import json
 import base64
-from PIL import Image
 import io
-import PyPDF2
 from database import Database
+from preprocessing import preprocess_uploads, pack_payload, create_process_pool
+from session_store import SessionStorage, SessionBudgetExceeded
 import hashlib
+import threading
+import uuid
+from prompts import (
+    MEDICAL_SYSTEM_PROMPT,
+    MODEL_NAME,
+    GENERATION_SETTINGS,
+    create_diagnosis_prompt,
+    create_rendering_prompt,
+    create_follow_up_questions,
+    can_render,
+    get_analysis_hash,
+    parse_follow_up_questions,
+)
 
 # Configure Gemini API with your key
 GEMINI_API_KEY = st.secrets["GOOGLE_API_KEY"]
@@ -24,41 +36,6 @@ hide_st_style = """
             """
 st.markdown(hide_st_style, unsafe_allow_html=True)
 
-# Professional System Prompt for Medical Analysis
-MEDICAL_SYSTEM_PROMPT = """You are a Medical Diagnostic Expert AI with advanced training in clinical diagnosis, radiology, pathology, and pharmacology.
-
-Your Core Responsibilities:
-1. MEDICAL ANALYSIS: Provide accurate, evidence-based medical analysis of symptoms, lab reports, and medical images
-2. STEP-BY-STEP REASONING: Always explain your diagnostic reasoning process clearly
-3. REFERENCE RANGES: When analyzing lab reports, carefully compare each value against normal reference ranges and explain any deviations
-4. IMAGING ANALYSIS: For X-rays, MRIs, CT scans, and other medical images, systematically identify:
-   - Normal anatomical structures
-   - Any structural abnormalities, lesions, or pathological findings
-   - Density changes, alignment issues, or asymmetries
-   - Recommendations for further imaging if needed
-5. MEDICATION ANALYSIS: Cross-reference current medications with reported symptoms to identify potential side effects or drug interactions
-6. DIFFERENTIAL DIAGNOSIS: Always provide 2-3 possible diagnoses ranked by likelihood with confidence levels
-7. SCIENTIFIC BASIS: Reference relevant medical literature, studies, or clinical guidelines when available
-8. SAFETY FIRST: Always indicate when immediate medical attention is required
-
-Your Analysis Must Include:
-- Clear, structured sections for easy reading
-- Evidence-based reasoning for each conclusion
-- Specific attention to abnormal findings with clinical significance
-- Appropriate medical terminology adjusted to the user's mode (patient/doctor)
-- Red flags that require urgent medical care
-- Recommended next steps for diagnosis or treatment
-
-Important Guidelines:
-- Be factual and precise - do not speculate beyond available evidence
-- Use proper medical terminology while maintaining clarity
-- Always compare lab values against standard reference ranges
-- Identify and explain any critical or concerning findings
-- Maintain professional medical standards in all communications
-- End every response with: "⚠️ DISCLAIMER: This analysis is for educational purposes only and should not replace professional medical consultation. Please consult a qualified healthcare provider for proper diagnosis and treatment."
-
-Remember: Your goal is to provide the most accurate, helpful, and professionally sound medical analysis possible while emphasizing the importance of professional medical care."""
-
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
     page_title="DocPro-Ai",
@@ -72,8 +49,22 @@ st.sidebar.image("logo.png", use_container_width=True)
 st.sidebar.divider()
 
 
+@st.cache_resource
+def get_database():
+    """Database shared by all sessions; tables are initialized once per server process"""
+    return Database()
+
 # Initialize database
-db = Database()
+db = get_database()
+
+@st.cache_resource
+def start_maintenance():
+    """Archive old reports and vacuum in one background thread per server process"""
+    thread = threading.Thread(target=db.run_maintenance_forever, daemon=True)
+    thread.start()
+    return thread
+
+start_maintenance()
 
 # Translations
 TRANSLATIONS = {
@@ -86,8 +77,8 @@ TRANSLATIONS = {
         'email': 'Email',
         'logout': 'Logout',
         'symptoms': 'Describe your symptoms',
-        'upload_image': 'Upload Medical Image',
-        'upload_pdf': 'Upload Lab Report (PDF)',
+        'upload_image': 'Upload Medical Images',
+        'upload_pdf': 'Upload Lab Reports (PDF)',
         'analyze': 'Analyze',
         'save_vault': 'Save to Vault',
         'view_vault': 'View Health Vault',
@@ -124,8 +115,8 @@ TRANSLATIONS = {
         'email': 'Email',
         'logout': 'Logout',
         'symptoms': 'Apne symptoms batayein',
-        'upload_image': 'Medical image upload karein',
-        'upload_pdf': 'Lab report upload karein (PDF)',
+        'upload_image': 'Medical images upload karein',
+        'upload_pdf': 'Lab reports upload karein (PDF)',
         'analyze': 'Analyze karein',
         'save_vault': 'Vault mein save karein',
         'view_vault': 'Health Vault dekhein',
@@ -153,6 +144,23 @@ if 'analysis_data' not in st.session_state:
     st.session_state.analysis_data = {}
 if 'follow_up_count' not in st.session_state:
     st.session_state.follow_up_count = 0
+if 'renderings' not in st.session_state:
+    st.session_state.renderings = {}
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+@st.cache_resource
+def get_session_storage():
+    """Blob storage shared by all sessions in this server process"""
+    return SessionStorage()
+
+# Share of each session's storage budget kept free for the generated analyses
+# (at most one per mode, each capped at max_output_tokens)
+ANALYSIS_RESERVE_BYTES = 1024 * 1024
+
+# Large per-session values live in the shared storage; session state keeps refs
+storage = get_session_storage()
+storage.touch(st.session_state.session_id)
 
 def get_text(key):
     """Get translated text"""
@@ -162,16 +170,11 @@ def init_gemini():
     """Initialize Gemini API with optimized configuration for medical analysis"""
     try:
         # Configure generation parameters for maximum accuracy
-        generation_config = genai.GenerationConfig(
-            temperature=0.1,  # Low temperature for factual, consistent responses
-            top_p=0.95,       # High top_p for comprehensive analysis
-            top_k=40,
-            max_output_tokens=8192,
-        )
+        generation_config = genai.GenerationConfig(**GENERATION_SETTINGS)
         
         # Initialize model with Gemini 2.0 Flash and professional configuration
         model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash',
+            model_name=MODEL_NAME,
             generation_config=generation_config,
             system_instruction=MEDICAL_SYSTEM_PROMPT
         )
@@ -189,128 +192,194 @@ def get_language_name():
     }
     return lang_map.get(st.session_state.language, 'English')
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF"""
+def store_blob(data, compress=True, reserve=ANALYSIS_RESERVE_BYTES):
+    """Store bytes in the session storage and return their ref
+
+    Everything but the generated analyses leaves `reserve` bytes of the
+    session budget free, so an expensive analysis always fits.
+    """
+    return storage.put(st.session_state.session_id, data, compress, reserve)
+
+def store_blobs(items):
+    """Store several (bytes, compress) items all-or-nothing and return their refs"""
+    refs = []
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    except Exception as e:
-        return f"Error reading PDF: {str(e)}"
+        for data, compress in items:
+            refs.append(store_blob(data, compress))
+    except SessionBudgetExceeded:
+        storage.release(st.session_state.session_id, refs)
+        raise
+    return refs
+
+def load_blob(ref):
+    """Load bytes from the session storage; raises KeyError once released"""
+    return storage.get(st.session_state.session_id, ref)
+
+def analysis_refs():
+    """Refs held by the current analysis and its cached renderings"""
+    data = st.session_state.analysis_data
+    refs = [image['ref'] for image in data.get('images', [])]
+    refs += [data['symptoms_ref']] if 'symptoms_ref' in data else []
+    refs += [entry['ref'] for entry in data.get('canonical', {}).values()]
+    return refs + list(st.session_state.renderings.values())
+
+def reset_analysis():
+    """Clear the current analysis and release its stored data"""
+    storage.release(st.session_state.session_id, analysis_refs())
+    st.session_state.conversation_state = 'initial'
+    st.session_state.analysis_data = {}
+    st.session_state.renderings = {}
+    st.session_state.follow_up_count = 0
 
-def analyze_with_gemini(model, prompt, image=None):
+def release_renderings():
+    """Release cached renderings; they are cheap to regenerate"""
+    storage.release(st.session_state.session_id, list(st.session_state.renderings.values()))
+    st.session_state.renderings = {}
+
+def release_prepared():
+    """Release the stored bytes of preprocessed uploads"""
+    cached = st.session_state.get('prepared_uploads')
+    if cached is not None and cached[1] is not None:
+        storage.release(st.session_state.session_id, prepared_refs(cached[1]))
+    st.session_state.prepared_uploads = None
+
+def empty_uploads():
+    return {'images': [], 'pdfs': [], 'duplicates': [], 'errors': [], 'timings': [], 'total_seconds': 0}
+
+def compact_prepared(prepared):
+    """Move image bytes and PDF text of preprocessed uploads into the session storage"""
+    refs = store_blobs(
+        [(image['data'], False) for image in prepared['images']] +
+        [(pdf['text'].encode(), True) for pdf in prepared['pdfs']]
+    )
+    image_refs, pdf_refs = refs[:len(prepared['images'])], refs[len(prepared['images']):]
+
+    compact = dict(prepared)
+    compact['images'] = [
+        {**{k: v for k, v in image.items() if k != 'data'}, 'ref': ref}
+        for image, ref in zip(prepared['images'], image_refs)
+    ]
+    compact['pdfs'] = [{'name': pdf['name'], 'ref': ref} for pdf, ref in zip(prepared['pdfs'], pdf_refs)]
+    return compact
+
+def load_prepared(compact):
+    """Load the stored bytes of compacted uploads back for this rerun"""
+    prepared = dict(compact)
+    prepared['images'] = [{**image, 'data': load_blob(image['ref'])} for image in compact['images']]
+    prepared['pdfs'] = [
+        {'name': pdf['name'], 'text': load_blob(pdf['ref']).decode()} for pdf in compact['pdfs']
+    ]
+    return prepared
+
+def prepared_refs(compact):
+    return [item['ref'] for item in compact['images'] + compact['pdfs']]
+
+@st.cache_resource
+def get_pdf_pool():
+    """PDF extraction process pool shared by all sessions in this server process"""
+    return create_process_pool()
+
+def prepare_uploads(uploaded_images, uploaded_pdfs):
+    """Preprocess uploaded files once per distinct set of uploads"""
+    images = [(f.name, f.getvalue()) for f in uploaded_images]
+    pdfs = [(f.name, f.getvalue()) for f in uploaded_pdfs]
+
+    signature = hashlib.sha256()
+    for name, data in images + pdfs:
+        signature.update(name.encode())
+        signature.update(hashlib.sha256(data).digest())
+    signature = signature.hexdigest()
+
+    # Cached as (signature, compacted uploads or None, error message or None)
+    cached = st.session_state.get('prepared_uploads')
+    if cached is not None and cached[0] == signature:
+        if cached[1] is None:
+            # Same uploads already failed the budget; don't preprocess them again
+            st.error(cached[2])
+            return empty_uploads()
+        try:
+            return load_prepared(cached[1])
+        except KeyError:
+            pass  # Released after the session was idle; preprocess again
+
+    release_prepared()
+
+    with st.spinner("Processing uploaded files..."):
+        prepared = preprocess_uploads(images, pdfs, get_pdf_pool())
+    if prepared['pool_broken']:
+        # Replace the dead pool for the next uploads
+        get_pdf_pool().shutdown(wait=False)
+        get_pdf_pool.clear()
+    try:
+        compact = compact_prepared(prepared)
+    except SessionBudgetExceeded:
+        # Make room by dropping cached renderings, then try once more
+        release_renderings()
+        try:
+            compact = compact_prepared(prepared)
+        except SessionBudgetExceeded as e:
+            error = f"Uploaded files are too large: {str(e)}"
+            st.session_state.prepared_uploads = (signature, None, error)
+            st.error(error)
+            return empty_uploads()
+
+    st.session_state.prepared_uploads = (signature, compact, None)
+    return prepared
+
+def analyze_with_gemini(model, prompt, images=None):
     """Analyze with Gemini API using professional system prompt"""
     try:
-        if image:
-            response = model.generate_content([prompt, image])
+        if images:
+            response = model.generate_content([prompt, *images])
         else:
             response = model.generate_content(prompt)
         return response.text
     except Exception as e:
         return f"Error during analysis: {str(e)}"
 
-def create_diagnosis_prompt(symptoms, follow_up_answers, medications, mode, language):
-    """Create diagnosis prompt for Gemini with professional context"""
-    lang_instruction = {
-        'en': 'Respond in English',
-        'hi': 'Respond in Hindi',
-        'hinglish': 'Respond in Hinglish (mix of Hindi and English)'
-    }
-    
-    mode_instruction = {
-        'patient': 'Use simple, easy-to-understand language suitable for patients. Avoid excessive medical jargon.',
-        'doctor': 'Use technical medical terminology, include ICD-10 codes where applicable, and provide detailed clinical reasoning.'
-    }
-    
-    prompt = f"""MEDICAL ANALYSIS REQUEST
-
-LANGUAGE: {lang_instruction[language]}
-COMMUNICATION MODE: {mode_instruction[mode]}
-
-PRIMARY SYMPTOMS AND CLINICAL PRESENTATION:
-{symptoms}
-
-FOLLOW-UP INFORMATION GATHERED:
-{follow_up_answers}
-
-CURRENT MEDICATIONS:
-{medications if medications else 'None reported'}
-
-ANALYSIS REQUIREMENTS:
-Please provide a comprehensive medical analysis following this structure:
-
-1. DIFFERENTIAL DIAGNOSIS
-   - List 2-3 possible diagnoses ranked by likelihood
-   - Provide confidence level for each (High/Medium/Low)
-   - Include relevant ICD-10 codes (if in Doctor Mode)
-
-2. DETAILED CLINICAL REASONING
-   - Explain the diagnostic reasoning step-by-step
-   - Highlight key symptoms supporting each diagnosis
-   - Note any contradicting or atypical presentations
-
-3. MEDICATION ANALYSIS (if applicable)
-   - Assess if any current medications could cause reported symptoms
-   - Identify potential drug interactions or side effects
-   - Note contraindications if any
-
-4. LABORATORY/IMAGING FINDINGS ANALYSIS
-   - If lab values provided, compare each against normal reference ranges
-   - Explain clinical significance of any abnormal values
-   - If medical images provided, systematically analyze for structural abnormalities
-
-5. SCIENTIFIC BASIS AND EVIDENCE
-   - Reference relevant medical literature or clinical guidelines
-   - Cite studies or evidence supporting the diagnosis
-   - Include PubMed references when available
-
-6. RECOMMENDED NEXT STEPS
-   - Suggest further diagnostic tests if needed
-   - Provide treatment considerations
-   - Lifestyle or management recommendations
-
-7. RED FLAGS AND URGENT CARE INDICATORS
-   - Identify symptoms requiring immediate medical attention
-   - Note any critical or life-threatening possibilities
-   - Specify when to seek emergency care
-
-Remember to maintain professionalism and end with the standard disclaimer."""
-    
-    return prompt
-
-def create_follow_up_questions(symptoms, language):
-    """Generate follow-up questions based on initial symptoms"""
-    lang_map = {
-        'en': 'English',
-        'hi': 'Hindi',
-        'hinglish': 'Hinglish'
-    }
-    
-    prompt = f"""Based on these symptoms: {symptoms}
-
-As a Medical Diagnostic Expert, generate 4 clinically relevant follow-up questions in {lang_map[language]} that would help narrow down the differential diagnosis. These questions should gather information about:
-- Onset, duration, and progression
-- Severity and characteristics
-- Aggravating or relieving factors
-- Associated symptoms
-
-For each question, provide 3-4 realistic answer options that patients would commonly report.
-
-Format as JSON:
-{{
-    "questions": [
-        {{
-            "question": "question text",
-            "options": ["option1", "option2", "option3", "option4"]
-        }}
-    ]
-}}
-
-Return ONLY the JSON, no other text."""
-    
-    return prompt
+def load_canonical(mode):
+    """Load the generated analysis a `mode` view is rendered from
+
+    Returns (text, (language, mode) it was generated in), or None when a new
+    diagnosis is needed. Patient views prefer the patient-mode analysis and
+    fall back to the doctor-mode one; doctor views need a doctor-mode one.
+    """
+    canonical = st.session_state.analysis_data.setdefault('canonical', {})
+    for source_mode in dict.fromkeys((mode, 'doctor')):
+        entry = canonical.get(source_mode)
+        if entry is None or not can_render(source_mode, mode):
+            continue
+        try:
+            return load_blob(entry['ref']).decode(), (entry['language'], source_mode)
+        except KeyError:
+            del canonical[source_mode]
+    return None
+
+def render_analysis(model, analysis, source, mode, language):
+    """Render a generated analysis for a language and mode, served from cache when possible
+
+    `source` is the (language, mode) the analysis was generated in; it is
+    returned as-is for that combination.
+    """
+    if (language, mode) == source:
+        return analysis
+
+    cache_key = (get_analysis_hash(analysis), language, mode)
+    if cache_key in st.session_state.renderings:
+        try:
+            return load_blob(st.session_state.renderings[cache_key]).decode()
+        except KeyError:
+            del st.session_state.renderings[cache_key]
+
+    with st.spinner("🌐 Adapting analysis..."):
+        rendering = analyze_with_gemini(model, create_rendering_prompt(analysis, mode, language))
+    # Don't cache failed rewrites so the next rerun retries them
+    if not rendering.startswith("Error during analysis"):
+        try:
+            st.session_state.renderings[cache_key] = store_blob(rendering.encode())
+        except SessionBudgetExceeded:
+            pass  # Served uncached; the rewrite is cheap to redo
+    return rendering
 
 def login_page():
     """Login page"""
@@ -384,7 +453,18 @@ def main_app():
         # Navigation
         page = st.radio("Navigation", ["Analyze Symptoms", "Health Vault"])
         
+        with st.expander("💾 Memory"):
+            stats = storage.stats()
+            st.caption(
+                f"This session: {storage.session_bytes(st.session_state.session_id) / 1024:.0f} KB  \n"
+                f"All sessions ({stats['sessions']}): {stats['total_session_bytes'] / 1024 / 1024:.1f} MB  \n"
+                f"In memory: {stats['memory_bytes'] / 1024 / 1024:.1f} MB, "
+                f"spilled to disk: {stats['disk_bytes'] / 1024 / 1024:.1f} MB"
+            )
+        
         if st.button(get_text('logout')):
+            reset_analysis()
+            release_prepared()
             st.session_state.logged_in = False
             st.session_state.username = None
             st.session_state.user_id = None
@@ -438,46 +518,85 @@ def analyze_symptoms_page():
         )
     
     with col2:
-        uploaded_image = st.file_uploader(get_text('upload_image'), type=['png', 'jpg', 'jpeg'])
-        uploaded_pdf = st.file_uploader(get_text('upload_pdf'), type=['pdf'])
+        uploaded_images = st.file_uploader(get_text('upload_image'), type=['png', 'jpg', 'jpeg'], accept_multiple_files=True)
+        uploaded_pdfs = st.file_uploader(get_text('upload_pdf'), type=['pdf'], accept_multiple_files=True)
     
     # Display uploaded files
-    image_data = None
-    pdf_text = None
+    prepared = prepare_uploads(uploaded_images or [], uploaded_pdfs or [])
     
-    if uploaded_image:
-        image = Image.open(uploaded_image)
-        st.image(image, caption="Uploaded Image", width=300)
-        image_data = image
+    if prepared['images']:
+        st.image(
+            [image['data'] for image in prepared['images']],
+            caption=[image['name'] for image in prepared['images']],
+            width=300
+        )
     
-    if uploaded_pdf:
-        pdf_text = extract_text_from_pdf(uploaded_pdf)
-        with st.expander("PDF Content Preview"):
-            st.text(pdf_text[:500] + "..." if len(pdf_text) > 500 else pdf_text)
+    # Near-identical images are skipped unless the user keeps them
+    keep_duplicates = [
+        duplicate for duplicate, original in prepared['duplicates']
+        if st.checkbox(
+            f"{duplicate} looks identical to {original} and will be skipped. Include it anyway",
+            key=f"keep_duplicate_{duplicate}"
+        )
+    ]
+    for name, error in prepared['errors']:
+        st.warning(f"{name}: {error}")
+    
+    for pdf in prepared['pdfs']:
+        with st.expander(f"PDF Content Preview - {pdf['name']}"):
+            st.text(pdf['text'][:500] + "..." if len(pdf['text']) > 500 else pdf['text'])
+    
+    if prepared['timings']:
+        with st.expander("⏱️ File processing times"):
+            for timing in sorted(prepared['timings'], key=lambda t: t['seconds'], reverse=True):
+                failed = "  (failed)" if timing.get('error') else ""
+                st.text(f"{timing['seconds'] * 1000:8.0f} ms  {timing['kind']:5}  {timing['file']}{failed}")
+            st.text(f"{prepared['total_seconds'] * 1000:8.0f} ms  total (parallel)")
     
     # Analyze button
     if st.button(get_text('analyze'), type="primary"):
-        if not symptoms_text and not uploaded_image and not uploaded_pdf:
+        if not symptoms_text and not prepared['images'] and not prepared['pdfs']:
             st.error("Please provide symptoms, image, or PDF report")
             return
         
-        # Combine all inputs
-        full_input = symptoms_text
-        if pdf_text:
-            full_input += f"\n\nLab Report Content:\n{pdf_text}"
+        # Combine all inputs into a single request within the payload budget
+        full_input, image_parts, notes = pack_payload(prepared, symptoms_text, keep_duplicates=keep_duplicates)
+        
+        # Store initial data; large values go to the session storage
+        reset_analysis()
+        try:
+            symptoms_ref, *image_refs = store_blobs(
+                [(full_input.encode(), True)] + [(part['data'], False) for part in image_parts]
+            )
+        except SessionBudgetExceeded as e:
+            st.error(f"This consultation is too large to process: {str(e)}")
+            return
         
-        # Store initial data
         st.session_state.analysis_data = {
-            'symptoms': full_input,
+            'symptoms_ref': symptoms_ref,
+            'symptoms_preview': full_input[:200],
+            'has_lab_reports': bool(prepared['pdfs']),
             'medications': medications,
-            'image': uploaded_image,
-            'image_data': image_data,
+            'images': [
+                {'mime_type': part['mime_type'], 'ref': ref}
+                for part, ref in zip(image_parts, image_refs)
+            ],
+            'payload_notes': notes,
             'follow_up_answers': {}
         }
         st.session_state.conversation_state = 'follow_up'
         st.session_state.follow_up_count = 0
         st.rerun()
     
+    # Stored analysis data is released when a session stays idle for too long
+    if st.session_state.conversation_state != 'initial':
+        try:
+            symptoms = load_blob(st.session_state.analysis_data['symptoms_ref']).decode()
+        except KeyError:
+            reset_analysis()
+            st.info("Your previous analysis expired after inactivity. Please start a new one.")
+            return
+    
     # Follow-up questions
     if st.session_state.conversation_state == 'follow_up':
         st.divider()
@@ -486,7 +605,7 @@ def analyze_symptoms_page():
         # Generate follow-up questions
         if st.session_state.follow_up_count < 4:
             questions_prompt = create_follow_up_questions(
-                st.session_state.analysis_data['symptoms'],
+                symptoms,
                 st.session_state.language
             )
             
@@ -495,14 +614,10 @@ def analyze_symptoms_page():
                 
                 try:
                     # Extract JSON from response
-                    json_start = response.find('{')
-                    json_end = response.rfind('}') + 1
-                    if json_start != -1 and json_end > json_start:
-                        json_str = response[json_start:json_end]
-                        questions_data = json.loads(json_str)
-                        
-                        if 'questions' in questions_data and st.session_state.follow_up_count < len(questions_data['questions']):
-                            q = questions_data['questions'][st.session_state.follow_up_count]
+                    questions = parse_follow_up_questions(response)
+                    if questions is not None:
+                        if st.session_state.follow_up_count < len(questions):
+                            q = questions[st.session_state.follow_up_count]
                             
                             st.write(f"**Question {st.session_state.follow_up_count + 1}:** {q['question']}")
                             
@@ -534,29 +649,55 @@ def analyze_symptoms_page():
         st.divider()
         st.subheader("📋 Professional Medical Analysis")
         
-        # Prepare follow-up answers text
-        follow_up_text = "\n".join([f"Q: {q}\nA: {a}" for q, a in st.session_state.analysis_data['follow_up_answers'].items()])
-        
-        # Create diagnosis prompt
-        diagnosis_prompt = create_diagnosis_prompt(
-            st.session_state.analysis_data['symptoms'],
-            follow_up_text,
-            st.session_state.analysis_data['medications'],
-            st.session_state.mode,
-            st.session_state.language
-        )
-        
-        with st.spinner("🔬 Analyzing with Professional Medical AI..."):
-            if st.session_state.analysis_data.get('image_data'):
-                result = analyze_with_gemini(model, diagnosis_prompt, st.session_state.analysis_data['image_data'])
-            else:
-                result = analyze_with_gemini(model, diagnosis_prompt)
+        # A diagnosis is generated at most once per mode, in the language
+        # active at the time; language switches and doctor-to-patient views
+        # are cheap rewrites of it
+        mode, language = st.session_state.mode, st.session_state.language
+        canonical = load_canonical(mode)
         
+        if canonical is None:
+            # Prepare follow-up answers text
+            follow_up_text = "\n".join([f"Q: {q}\nA: {a}" for q, a in st.session_state.analysis_data['follow_up_answers'].items()])
+
+            # Create diagnosis prompt
+            diagnosis_prompt = create_diagnosis_prompt(
+                symptoms,
+                follow_up_text,
+                st.session_state.analysis_data['medications'],
+                mode,
+                language
+            )
+
+            image_parts = [
+                {'mime_type': image['mime_type'], 'data': load_blob(image['ref'])}
+                for image in st.session_state.analysis_data['images']
+            ]
+            with st.spinner("🔬 Analyzing with Professional Medical AI..."):
+                if image_parts:
+                    canonical_result = analyze_with_gemini(model, diagnosis_prompt, image_parts)
+                else:
+                    canonical_result = analyze_with_gemini(model, diagnosis_prompt)
+
+            if canonical_result.startswith("Error during analysis"):
+                st.error(canonical_result)
+                return
+            try:
+                # Stored into the budget reserved for analyses
+                ref = store_blob(canonical_result.encode(), reserve=0)
+            except SessionBudgetExceeded as e:
+                st.error(f"This analysis is too large to keep: {str(e)}")
+                return
+            st.session_state.analysis_data['canonical'][mode] = {'language': language, 'ref': ref}
+            canonical = (canonical_result, (language, mode))
+
+        analysis, source = canonical
+        result = render_analysis(model, analysis, source, mode, language)
+
         # Display results
+        for note in st.session_state.analysis_data.get('payload_notes', []):
+            st.warning(note)
         st.markdown(result)
         
-        # Store result for saving
-        st.session_state.analysis_data['result'] = result
         st.session_state.analysis_data['timestamp'] = datetime.now().isoformat()
         
         # Save to vault button
@@ -565,24 +706,22 @@ def analyze_symptoms_page():
         with col1:
             if st.button(get_text('save_vault'), type="primary"):
                 category = 'General'
-                if st.session_state.analysis_data.get('image'):
+                if st.session_state.analysis_data.get('images'):
                     category = 'Radiology'
-                elif 'Lab Report' in st.session_state.analysis_data['symptoms']:
+                elif st.session_state.analysis_data.get('has_lab_reports'):
                     category = 'Pathology'
                 
                 db.save_report(
                     st.session_state.user_id,
                     category,
-                    st.session_state.analysis_data['symptoms'][:200],
+                    st.session_state.analysis_data['symptoms_preview'],
                     result
                 )
                 st.success("✅ Saved to Health Vault!")
         
         with col2:
             if st.button("🔄 New Analysis"):
-                st.session_state.conversation_state = 'initial'
-                st.session_state.analysis_data = {}
-                st.session_state.follow_up_count = 0
+                reset_analysis()
                 st.rerun()
 
 def health_vault_page():
@@ -615,7 +754,12 @@ def health_vault_page():
             st.markdown(f"**Symptoms:** {symptoms}")
             st.divider()
             st.markdown("**Analysis:**")
-            st.markdown(diagnosis)
+            if diagnosis is None:
+                # Archived report: the analysis is loaded from the archive on demand
+                if st.button("📦 Load archived analysis", key=f"load_{report_id}"):
+                    st.markdown(db.get_report_by_id(report_id, st.session_state.user_id)[4])
+            else:
+                st.markdown(diagnosis)
             
             col1, col2 = st.columns([1, 5])
             with col1:
@@ -1,21 +1,53 @@
 import sqlite3
 import hashlib
+import os
+import time
+import zlib
 from datetime import datetime
 
+# Reports older than this are moved to the archive database
+DEFAULT_RETENTION_DAYS = 365
+# Minimum seconds between two retention/vacuum maintenance runs
+DEFAULT_MAINTENANCE_INTERVAL = 6 * 60 * 60
+# How often background maintenance loops check whether a run is due
+MAINTENANCE_CHECK_SECONDS = 15 * 60
+ARCHIVE_BATCH_SIZE = 500
+INCREMENTAL_VACUUM_PAGES = 256
+# Symptoms kept in the hot table for archived report stubs
+STUB_SYMPTOMS_LENGTH = 200
+
+# Explicit column list so report rows keep the same shape as the table evolves
+REPORT_COLUMNS = 'id, user_id, category, symptoms, CASE WHEN archived THEN NULL ELSE diagnosis END, created_at'
+
 class Database:
-    def __init__(self, db_name='cdss_health_vault.db'):
+    def __init__(self, db_name='cdss_health_vault.db', archive_name=None,
+                 retention_days=DEFAULT_RETENTION_DAYS,
+                 maintenance_interval=DEFAULT_MAINTENANCE_INTERVAL):
         self.db_name = db_name
+        self.archive_name = archive_name or '{}_archive{}'.format(*os.path.splitext(db_name))
+        self.retention_days = retention_days
+        self.maintenance_interval = maintenance_interval
         self.init_database()
     
-    def get_connection(self):
-        """Get database connection"""
-        return sqlite3.connect(self.db_name, check_same_thread=False)
+    def get_connection(self, attach_archive=False):
+        """Get database connection, with the archive database attached if needed"""
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        if attach_archive:
+            conn.execute('ATTACH DATABASE ? AS archive', (self.archive_name,))
+        return conn
     
     def init_database(self):
         """Initialize database tables"""
-        conn = self.get_connection()
+        conn = self.get_connection(attach_archive=True)
         cursor = conn.cursor()
         
+        # Freed pages are returned to the OS by incremental_vacuum() steps.
+        # New files can switch modes right away; existing ones need a VACUUM,
+        # which enable_incremental_vacuum() runs from background maintenance
+        for schema in ('main', 'archive'):
+            if cursor.execute(f'PRAGMA {schema}.page_count').fetchone()[0] == 0:
+                cursor.execute(f'PRAGMA {schema}.auto_vacuum = INCREMENTAL')
+        
         # Users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -36,10 +68,44 @@ class Database:
                 symptoms TEXT NOT NULL,
                 diagnosis TEXT NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                archived INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         ''')
         
+        # Databases created before retention existed lack the archived flag
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(health_reports)')]
+        if 'archived' not in columns:
+            cursor.execute('ALTER TABLE health_reports ADD COLUMN archived INTEGER NOT NULL DEFAULT 0')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_health_reports_user_created
+            ON health_reports (user_id, created_at)
+        ''')
+        
+        # Archived report bodies, zlib-compressed; the hot table keeps a stub
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive.health_reports (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                symptoms BLOB NOT NULL,
+                diagnosis BLOB NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Last run of periodic maintenance tasks, shared by all processes;
+        # checked first so opening an existing database doesn't take a write lock
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'maintenance'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS maintenance (
+                    task TEXT PRIMARY KEY,
+                    last_run REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO maintenance (task) VALUES ('retention')")
+        
         conn.commit()
         conn.close()
     
@@ -103,7 +169,7 @@ class Database:
         cursor = conn.cursor()
         
         cursor.execute(
-            'SELECT * FROM health_reports WHERE user_id = ? ORDER BY created_at DESC',
+            f'SELECT {REPORT_COLUMNS} FROM health_reports WHERE user_id = ? ORDER BY created_at DESC',
             (user_id,)
         )
         
@@ -112,9 +178,30 @@ class Database:
         
         return reports
     
+    def search_user_reports(self, user_id, query):
+        """Search a user's reports by category, symptoms or diagnosis text
+
+        Archived reports only match on category and their symptoms stub.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        pattern = f"%{query}%"
+        cursor.execute(
+            f'''SELECT {REPORT_COLUMNS} FROM health_reports
+               WHERE user_id = ? AND (category LIKE ? OR symptoms LIKE ? OR diagnosis LIKE ?)
+               ORDER BY created_at DESC''',
+            (user_id, pattern, pattern, pattern)
+        )
+
+        reports = cursor.fetchall()
+        conn.close()
+
+        return reports
+
     def delete_report(self, report_id, user_id):
         """Delete a report (only if it belongs to the user)"""
-        conn = self.get_connection()
+        conn = self.get_connection(attach_archive=True)
         cursor = conn.cursor()
         
         cursor.execute(
@@ -122,21 +209,157 @@ class Database:
             (report_id, user_id)
         )
         
+        if cursor.rowcount:
+            cursor.execute('DELETE FROM archive.health_reports WHERE id = ?', (report_id,))
+        
         conn.commit()
+        self.incremental_vacuum(conn)
         conn.close()
         return True
     
     def get_report_by_id(self, report_id, user_id):
-        """Get a specific report"""
-        conn = self.get_connection()
+        """Get a specific report, loading its body from the archive if needed"""
+        conn = self.get_connection(attach_archive=True)
         cursor = conn.cursor()
         
         cursor.execute(
-            'SELECT * FROM health_reports WHERE id = ? AND user_id = ?',
+            '''SELECT h.id, h.user_id, h.category, h.symptoms, h.diagnosis, h.created_at,
+                      a.symptoms, a.diagnosis
+               FROM health_reports h LEFT JOIN archive.health_reports a
+               ON h.archived AND a.id = h.id
+               WHERE h.id = ? AND h.user_id = ?''',
             (report_id, user_id)
         )
         
-        report = cursor.fetchone()
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row is None:
+            return None
+        report, archived_symptoms, archived_diagnosis = row[:6], row[6], row[7]
+        if archived_diagnosis is not None:
+            report = (
+                report[0], report[1], report[2],
+                zlib.decompress(archived_symptoms).decode(),
+                zlib.decompress(archived_diagnosis).decode(),
+                report[5]
+            )
+        return report
+    
+    def archive_old_reports(self, retention_days=None):
+        """Move report bodies older than the retention period into the archive database"""
+        if retention_days is None:
+            retention_days = self.retention_days
+        
+        conn = self.get_connection(attach_archive=True)
+        cursor = conn.cursor()
+        archived = 0
+        
+        while True:
+            cursor.execute(
+                '''SELECT id, user_id, symptoms, diagnosis FROM health_reports
+                   WHERE archived = 0 AND created_at < datetime('now', ?)
+                   LIMIT ?''',
+                (f'-{int(retention_days)} days', ARCHIVE_BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            # Archive insert and stub update commit together
+            cursor.executemany(
+                'INSERT OR REPLACE INTO archive.health_reports (id, user_id, symptoms, diagnosis) VALUES (?, ?, ?, ?)',
+                [
+                    (report_id, user_id, zlib.compress(symptoms.encode()), zlib.compress(diagnosis.encode()))
+                    for report_id, user_id, symptoms, diagnosis in rows
+                ]
+            )
+            cursor.executemany(
+                "UPDATE health_reports SET archived = 1, diagnosis = '', symptoms = substr(symptoms, 1, ?) WHERE id = ?",
+                [(STUB_SYMPTOMS_LENGTH, row[0]) for row in rows]
+            )
+            conn.commit()
+            archived += len(rows)
+        
         conn.close()
+        return archived
+    
+    def incremental_vacuum(self, conn=None, pages=INCREMENTAL_VACUUM_PAGES):
+        """Return up to `pages` free pages per database file to the OS"""
+        own_conn = conn is None
+        if own_conn:
+            conn = self.get_connection(attach_archive=True)
         
-        return report
\ No newline at end of file
+        for schema in ('main', 'archive'):
+            # The pragma frees one page per step, so it must be fully consumed
+            conn.execute(f'PRAGMA {schema}.incremental_vacuum({int(pages)})').fetchall()
+        
+        if own_conn:
+            conn.close()
+    
+    def enable_incremental_vacuum(self):
+        """Switch database files created before incremental auto_vacuum over to it
+
+        This runs a full VACUUM, which locks the database, on each file that
+        still needs it, so it belongs in background maintenance rather than
+        in request handling.
+        """
+        conn = self.get_connection(attach_archive=True)
+        
+        for schema in ('main', 'archive'):
+            if conn.execute(f'PRAGMA {schema}.auto_vacuum').fetchone()[0] != 2:
+                conn.execute(f'PRAGMA {schema}.auto_vacuum = INCREMENTAL')
+                conn.execute(f'VACUUM {schema}')
+        
+        conn.close()
+    
+    def maintenance_due(self):
+        """Check, without taking a write lock, whether a maintenance run is due"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT last_run FROM maintenance WHERE task = 'retention'")
+        row = cursor.fetchone()
+        conn.close()
+        
+        return row is None or time.time() - row[0] >= self.maintenance_interval
+    
+    def run_maintenance(self, force=False):
+        """Archive old reports and vacuum, at most once per maintenance interval
+
+        The run is claimed atomically in the maintenance table, so only one
+        process performs it per interval. This does the work inline; app code
+        should call it from a background thread such as
+        run_maintenance_forever().
+        """
+        if not force and not self.maintenance_due():
+            return 0
+        
+        now = time.time()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "UPDATE maintenance SET last_run = ? WHERE task = 'retention' AND (? OR last_run <= ?)",
+            (now, force, now - self.maintenance_interval)
+        )
+        claimed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        
+        if not claimed:
+            return 0
+        
+        self.enable_incremental_vacuum()
+        archived = self.archive_old_reports()
+        self.incremental_vacuum()
+        return archived
+    
+    def run_maintenance_forever(self, check_interval=MAINTENANCE_CHECK_SECONDS):
+        """Periodically run maintenance; meant for a daemon thread"""
+        while True:
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f"Maintenance failed: {str(e)}")
+            time.sleep(check_interval)
\ No newline at end of file
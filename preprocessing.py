@@ -0,0 +1,277 @@
+"""Upload preprocessing for multi-file consultations.
+
+Images are decoded and downscaled in a thread pool (Pillow releases the GIL
+while decoding), lab report PDFs are extracted in a long-lived process pool
+(PyPDF2 is pure Python), near-identical images are dropped by perceptual
+hash unless the user keeps them, and the result is packed into a single multimodal request within a
+payload budget.
+"""
+import io
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+from PIL import Image
+
+from prompts import MEDICAL_SYSTEM_PROMPT
+
+# Longest image side sent to the model; larger images are downscaled
+MAX_IMAGE_SIDE = 1568
+MIN_IMAGE_SIDE = 512
+JPEG_QUALITY = 85
+# Gemini's inline request limit covers the whole encoded request: images
+# are sent base64-encoded, next to the prompt, system instruction and JSON
+# envelope
+REQUEST_LIMIT_BYTES = 20 * 1000 * 1000
+REQUEST_OVERHEAD_BYTES = len(MEDICAL_SYSTEM_PROMPT.encode()) + 64 * 1024
+PAYLOAD_BUDGET_BYTES = REQUEST_LIMIT_BYTES - REQUEST_OVERHEAD_BYTES
+# Share of the budget lab report text may use before it is truncated
+MAX_TEXT_SHARE = 0.25
+# Images whose 256-bit difference hashes differ in at most this many bits are
+# flagged as duplicates; looser matches would catch follow-up radiographs of
+# the same view
+DUPLICATE_HASH_SIZE = 16
+DUPLICATE_HASH_DISTANCE = 2
+MAX_WORKERS = 4
+
+
+def create_process_pool(max_workers=MAX_WORKERS):
+    """Create a PDF extraction pool; create it once and reuse it across uploads
+
+    Workers are started with forkserver (or spawn) rather than fork, since
+    forking a multithreaded server process can deadlock.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def failed_upload(name, kind, data, error, start):
+    """Error entry for a file that could not be processed, with its timing"""
+    return {
+        'name': name,
+        'error': error,
+        'timing': {
+            'file': name,
+            'kind': kind,
+            'input_bytes': len(data),
+            'output_bytes': 0,
+            'seconds': time.perf_counter() - start,
+            'error': True,
+        },
+    }
+
+
+def encode_jpeg(image, max_side, quality=JPEG_QUALITY):
+    """Downscale an image to max_side and encode it as JPEG bytes"""
+    image = image.copy()
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue(), image.size
+
+
+def encoded_size(size):
+    """Size of `size` bytes once base64-encoded for the request"""
+    return 4 * math.ceil(size / 3)
+
+
+def to_8bit(image):
+    """Rescale a 16/32-bit integer image (e.g. exported DICOM) to 8-bit grayscale
+
+    Converting such images straight to RGB clips every value above 255.
+    """
+    image = image.convert('I')
+    peak = image.getextrema()[1] or 1
+    return image.point(lambda value: value * (255 / peak)).convert('L')
+
+
+def difference_hash(image, hash_size=DUPLICATE_HASH_SIZE):
+    """Perceptual difference hash (dHash) of an image as an int"""
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size)).getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def preprocess_image(name, data):
+    """Decode, downscale and hash one uploaded image"""
+    start = time.perf_counter()
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        if image.mode == 'I' or image.mode.startswith('I;16'):
+            image = to_8bit(image)
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        jpeg, size = encode_jpeg(image, MAX_IMAGE_SIDE)
+    except Exception as e:
+        return failed_upload(name, 'image', data, f"Error reading image: {str(e)}", start)
+
+    return {
+        'name': name,
+        'mime_type': 'image/jpeg',
+        'data': jpeg,
+        'size': size,
+        'phash': difference_hash(image),
+        'timing': {
+            'file': name,
+            'kind': 'image',
+            'input_bytes': len(data),
+            'output_bytes': len(jpeg),
+            'seconds': time.perf_counter() - start,
+        },
+    }
+
+
+def extract_pdf_text(name, data):
+    """Extract text from one PDF; runs in a worker process"""
+    start = time.perf_counter()
+    try:
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+        text = ""
+        for page in pdf_reader.pages:
+            text += page.extract_text()
+    except Exception as e:
+        return failed_upload(name, 'pdf', data, f"Error reading PDF: {str(e)}", start)
+
+    return {
+        'name': name,
+        'text': text,
+        'timing': {
+            'file': name,
+            'kind': 'pdf',
+            'input_bytes': len(data),
+            'output_bytes': len(text.encode()),
+            'seconds': time.perf_counter() - start,
+        },
+    }
+
+
+def flag_duplicates(images):
+    """Flag images that are perceptually near-identical to an earlier one
+
+    Flagged images get a 'duplicate_of' name and are left out by
+    pack_payload() unless the user keeps them. Returns (name, original) pairs.
+    """
+    originals, duplicates = [], []
+    for image in images:
+        match = next(
+            (o for o in originals if bin(o['phash'] ^ image['phash']).count('1') <= DUPLICATE_HASH_DISTANCE),
+            None
+        )
+        if match is None:
+            originals.append(image)
+        else:
+            image['duplicate_of'] = match['name']
+            duplicates.append((image['name'], match['name']))
+    return duplicates
+
+
+def preprocess_uploads(images, pdfs, pdf_pool=None):
+    """Preprocess uploaded files concurrently
+
+    `images` and `pdfs` are lists of (name, bytes). PDFs are extracted in
+    `pdf_pool` (see create_process_pool), or in the thread pool when none is
+    given. Returns plain data: decoded images (near-duplicates flagged),
+    extracted PDF texts, duplicates, errors and per-file timings. 'pool_broken' is set when the
+    process pool died, so the caller can replace it.
+    """
+    start = time.perf_counter()
+    pool_broken = False
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as threads:
+        image_futures = [threads.submit(preprocess_image, name, data) for name, data in images]
+
+        pdf_futures = []
+        for name, data in pdfs:
+            try:
+                pdf_futures.append((pdf_pool or threads).submit(extract_pdf_text, name, data))
+            except BrokenProcessPool:
+                pool_broken = True
+                pdf_futures.append(threads.submit(extract_pdf_text, name, data))
+
+        pdf_results = []
+        for (name, data), future in zip(pdfs, pdf_futures):
+            try:
+                pdf_results.append(future.result())
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); extract in this process instead
+                pool_broken = True
+                pdf_results.append(extract_pdf_text(name, data))
+            except Exception as e:
+                pdf_results.append(failed_upload(name, 'pdf', data, f"Error reading PDF: {str(e)}", start))
+
+        image_results = [future.result() for future in image_futures]
+
+    failed = [r for r in image_results + pdf_results if 'error' in r]
+    decoded = [r for r in image_results if 'error' not in r]
+    extracted = [r for r in pdf_results if 'error' not in r]
+    duplicates = flag_duplicates(decoded)
+
+    return {
+        'images': decoded,
+        'pdfs': extracted,
+        'duplicates': duplicates,
+        'errors': [(r['name'], r['error']) for r in failed],
+        'timings': [r['timing'] for r in image_results + pdf_results],
+        'total_seconds': time.perf_counter() - start,
+        'pool_broken': pool_broken,
+    }
+
+
+def combine_lab_text(pdfs, max_bytes):
+    """Concatenate lab report texts, truncating so they fit in max_bytes"""
+    text = "".join(f"\n\nLab Report Content ({pdf['name']}):\n{pdf['text']}" for pdf in pdfs)
+    encoded = text.encode()
+    if len(encoded) <= max_bytes:
+        return text, False
+    return encoded[:max_bytes].decode(errors='ignore') + "\n[Lab report text truncated]", True
+
+
+def pack_payload(prepared, text, budget=PAYLOAD_BUDGET_BYTES, keep_duplicates=()):
+    """Fit the prompt text, lab text and images into one request budget
+
+    Flagged duplicates are left out unless their names are in
+    keep_duplicates. Lab text is capped at MAX_TEXT_SHARE of the budget;
+    images are then re-encoded smaller, largest first, and the largest is
+    dropped only once it can't be shrunk any further. Images count at their
+    base64-encoded size. Returns (full_text, image_parts, notes).
+    """
+    notes = []
+    lab_text, truncated = combine_lab_text(prepared['pdfs'], int(budget * MAX_TEXT_SHARE))
+    if truncated:
+        notes.append("Lab report text was truncated to fit the request size limit")
+    full_text = text + lab_text
+
+    images = [
+        dict(image) for image in prepared['images']
+        if 'duplicate_of' not in image or image['name'] in keep_duplicates
+    ]
+    remaining = budget - len(full_text.encode())
+
+    def total():
+        return sum(encoded_size(len(image['data'])) for image in images)
+
+    while images and total() > remaining:
+        largest = max(images, key=lambda image: len(image['data']))
+        side = int(max(largest['size']) * 0.75)
+        if side < MIN_IMAGE_SIDE:
+            # Dropping the image that can't shrink further frees the most space
+            images.remove(largest)
+            notes.append(f"{largest['name']} was left out to fit the request size limit")
+            continue
+        largest['data'], largest['size'] = encode_jpeg(Image.open(io.BytesIO(largest['data'])), side)
+        largest['downscaled'] = True
+
+    notes += [f"{image['name']} was downscaled to fit the request size limit"
+              for image in images if image.get('downscaled')]
+    parts = [{'mime_type': image['mime_type'], 'data': image['data']} for image in images]
+    return full_text, parts, notes
@@ -0,0 +1,203 @@
+"""Prompt builders shared by the Streamlit app and the HTTP API"""
+import hashlib
+import json
+
+# Professional System Prompt for Medical Analysis
+MEDICAL_SYSTEM_PROMPT = """You are a Medical Diagnostic Expert AI with advanced training in clinical diagnosis, radiology, pathology, and pharmacology.
+
+Your Core Responsibilities:
+1. MEDICAL ANALYSIS: Provide accurate, evidence-based medical analysis of symptoms, lab reports, and medical images
+2. STEP-BY-STEP REASONING: Always explain your diagnostic reasoning process clearly
+3. REFERENCE RANGES: When analyzing lab reports, carefully compare each value against normal reference ranges and explain any deviations
+4. IMAGING ANALYSIS: For X-rays, MRIs, CT scans, and other medical images, systematically identify:
+   - Normal anatomical structures
+   - Any structural abnormalities, lesions, or pathological findings
+   - Density changes, alignment issues, or asymmetries
+   - Recommendations for further imaging if needed
+5. MEDICATION ANALYSIS: Cross-reference current medications with reported symptoms to identify potential side effects or drug interactions
+6. DIFFERENTIAL DIAGNOSIS: Always provide 2-3 possible diagnoses ranked by likelihood with confidence levels
+7. SCIENTIFIC BASIS: Reference relevant medical literature, studies, or clinical guidelines when available
+8. SAFETY FIRST: Always indicate when immediate medical attention is required
+
+Your Analysis Must Include:
+- Clear, structured sections for easy reading
+- Evidence-based reasoning for each conclusion
+- Specific attention to abnormal findings with clinical significance
+- Appropriate medical terminology adjusted to the user's mode (patient/doctor)
+- Red flags that require urgent medical care
+- Recommended next steps for diagnosis or treatment
+
+Important Guidelines:
+- Be factual and precise - do not speculate beyond available evidence
+- Use proper medical terminology while maintaining clarity
+- Always compare lab values against standard reference ranges
+- Identify and explain any critical or concerning findings
+- Maintain professional medical standards in all communications
+- End every response with: "⚠️ DISCLAIMER: This analysis is for educational purposes only and should not replace professional medical consultation. Please consult a qualified healthcare provider for proper diagnosis and treatment."
+
+Remember: Your goal is to provide the most accurate, helpful, and professionally sound medical analysis possible while emphasizing the importance of professional medical care."""
+
+# Model configuration shared by every client of the prompts
+MODEL_NAME = 'gemini-2.0-flash'
+GENERATION_SETTINGS = {
+    'temperature': 0.1,  # Low temperature for factual, consistent responses
+    'top_p': 0.95,       # High top_p for comprehensive analysis
+    'top_k': 40,
+    'max_output_tokens': 8192,
+}
+
+def create_diagnosis_prompt(symptoms, follow_up_answers, medications, mode, language):
+    """Create diagnosis prompt for Gemini with professional context"""
+    lang_instruction = {
+        'en': 'Respond in English',
+        'hi': 'Respond in Hindi',
+        'hinglish': 'Respond in Hinglish (mix of Hindi and English)'
+    }
+    
+    mode_instruction = {
+        'patient': 'Use simple, easy-to-understand language suitable for patients. Avoid excessive medical jargon.',
+        'doctor': 'Use technical medical terminology, include ICD-10 codes where applicable, and provide detailed clinical reasoning.'
+    }
+    
+    prompt = f"""MEDICAL ANALYSIS REQUEST
+
+LANGUAGE: {lang_instruction[language]}
+COMMUNICATION MODE: {mode_instruction[mode]}
+
+PRIMARY SYMPTOMS AND CLINICAL PRESENTATION:
+{symptoms}
+
+FOLLOW-UP INFORMATION GATHERED:
+{follow_up_answers}
+
+CURRENT MEDICATIONS:
+{medications if medications else 'None reported'}
+
+ANALYSIS REQUIREMENTS:
+Please provide a comprehensive medical analysis following this structure:
+
+1. DIFFERENTIAL DIAGNOSIS
+   - List 2-3 possible diagnoses ranked by likelihood
+   - Provide confidence level for each (High/Medium/Low)
+   - Include relevant ICD-10 codes (if in Doctor Mode)
+
+2. DETAILED CLINICAL REASONING
+   - Explain the diagnostic reasoning step-by-step
+   - Highlight key symptoms supporting each diagnosis
+   - Note any contradicting or atypical presentations
+
+3. MEDICATION ANALYSIS (if applicable)
+   - Assess if any current medications could cause reported symptoms
+   - Identify potential drug interactions or side effects
+   - Note contraindications if any
+
+4. LABORATORY/IMAGING FINDINGS ANALYSIS
+   - If lab values provided, compare each against normal reference ranges
+   - Explain clinical significance of any abnormal values
+   - If medical images provided, systematically analyze for structural abnormalities
+
+5. SCIENTIFIC BASIS AND EVIDENCE
+   - Reference relevant medical literature or clinical guidelines
+   - Cite studies or evidence supporting the diagnosis
+   - Include PubMed references when available
+
+6. RECOMMENDED NEXT STEPS
+   - Suggest further diagnostic tests if needed
+   - Provide treatment considerations
+   - Lifestyle or management recommendations
+
+7. RED FLAGS AND URGENT CARE INDICATORS
+   - Identify symptoms requiring immediate medical attention
+   - Note any critical or life-threatening possibilities
+   - Specify when to seek emergency care
+
+Remember to maintain professionalism and end with the standard disclaimer."""
+    
+    return prompt
+
+def create_rendering_prompt(analysis, mode, language):
+    """Create a text-only prompt that rewrites an analysis for a language and mode
+
+    Only use it where can_render() allows the change of mode.
+    """
+    lang_instruction = {
+        'en': 'English',
+        'hi': 'Hindi',
+        'hinglish': 'Hinglish (mix of Hindi and English)'
+    }
+
+    mode_instruction = {
+        'patient': 'Use simple, easy-to-understand language suitable for patients. Avoid excessive medical jargon and drop ICD-10 codes.',
+        'doctor': 'Use technical medical terminology, keep ICD-10 codes where applicable, and keep the detailed clinical reasoning.'
+    }
+
+    prompt = f"""MEDICAL ANALYSIS REWRITE REQUEST
+
+Rewrite the medical analysis below for a different audience. Do NOT change the clinical content:
+keep the same diagnoses, confidence levels, lab/imaging findings, red flags and next steps.
+Do not add new findings and do not remove any section.
+
+TARGET LANGUAGE: {lang_instruction[language]}
+COMMUNICATION MODE: {mode_instruction[mode]}
+
+ANALYSIS:
+{analysis}
+
+Keep the same section structure and end with the standard disclaimer in the target language."""
+
+    return prompt
+
+def can_render(source_mode, mode):
+    """Whether an analysis written in source_mode can be rewritten for mode
+
+    Rewrites only go "downward": a patient-mode analysis leaves out the ICD-10
+    codes and clinical reasoning of doctor mode, so a doctor view needs a
+    doctor-mode diagnosis.
+    """
+    return source_mode == 'doctor' or mode == 'patient'
+
+def get_analysis_hash(analysis):
+    """Get a stable hash of a canonical analysis, used as the rendering cache key"""
+    return hashlib.sha256(analysis.encode()).hexdigest()
+
+def create_follow_up_questions(symptoms, language):
+    """Generate follow-up questions based on initial symptoms"""
+    lang_map = {
+        'en': 'English',
+        'hi': 'Hindi',
+        'hinglish': 'Hinglish'
+    }
+    
+    prompt = f"""Based on these symptoms: {symptoms}
+
+As a Medical Diagnostic Expert, generate 4 clinically relevant follow-up questions in {lang_map[language]} that would help narrow down the differential diagnosis. These questions should gather information about:
+- Onset, duration, and progression
+- Severity and characteristics
+- Aggravating or relieving factors
+- Associated symptoms
+
+For each question, provide 3-4 realistic answer options that patients would commonly report.
+
+Format as JSON:
+{{
+    "questions": [
+        {{
+            "question": "question text",
+            "options": ["option1", "option2", "option3", "option4"]
+        }}
+    ]
+}}
+
+Return ONLY the JSON, no other text."""
+    
+    return prompt
+
+def parse_follow_up_questions(response):
+    """Extract the follow-up questions list from a model response, or None if it has no JSON"""
+    json_start = response.find('{')
+    json_end = response.rfind('}') + 1
+    if json_start == -1 or json_end <= json_start:
+        return None
+
+    questions_data = json.loads(response[json_start:json_end])
+    return questions_data.get('questions', [])
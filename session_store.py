@@ -0,0 +1,222 @@
+"""Bounded blob storage for per-session data.
+
+Streamlit keeps everything in st.session_state for as long as a browser tab
+is connected, so large values (uploaded images, lab text, analyses) are
+stored here instead and session state only holds their refs. Blobs are
+content-addressed and shared between sessions, kept in an in-memory LRU up
+to a memory limit and spilled to disk beyond it. Each session has a byte
+budget, and sessions idle for longer than the timeout have their blobs
+released.
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+DEFAULT_MEMORY_LIMIT_BYTES = 256 * 1024 * 1024
+DEFAULT_SESSION_BUDGET_BYTES = 48 * 1024 * 1024
+DEFAULT_IDLE_TIMEOUT_SECONDS = 30 * 60
+# Minimum seconds between two idle-session sweeps
+REAP_INTERVAL_SECONDS = 60
+
+
+class SessionBudgetExceeded(Exception):
+    """Raised when storing a blob would take a session over its byte budget"""
+
+
+class SessionStorage:
+    """Shared, thread-safe blob store with per-session accounting"""
+
+    def __init__(self, memory_limit_bytes=DEFAULT_MEMORY_LIMIT_BYTES,
+                 session_budget_bytes=DEFAULT_SESSION_BUDGET_BYTES,
+                 idle_timeout_seconds=DEFAULT_IDLE_TIMEOUT_SECONDS,
+                 spill_dir=None):
+        self.memory_limit_bytes = memory_limit_bytes
+        self.session_budget_bytes = session_budget_bytes
+        self.idle_timeout_seconds = idle_timeout_seconds
+
+        if spill_dir is None:
+            spill_dir = tempfile.mkdtemp(prefix='docpro_blobs_')
+            atexit.register(shutil.rmtree, spill_dir, True)
+        self.spill_dir = spill_dir
+
+        self.lock = threading.RLock()
+        # ref -> {'size': stored bytes, 'compressed': bool, 'owners': set of session ids, 'on_disk': bool}
+        self.blobs = {}
+        # ref -> stored bytes, least recently used first
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        # session id -> {'last_access': timestamp, 'refs': {ref: size}, 'counts': {ref: puts}}
+        self.sessions = {}
+        self.last_reap = time.monotonic()
+
+    # --- Sessions ---
+
+    def _session(self, session_id):
+        session = self.sessions.setdefault(session_id, {'last_access': 0, 'refs': {}, 'counts': {}})
+        session['last_access'] = time.monotonic()
+        return session
+
+    def touch(self, session_id):
+        """Mark a session as active and opportunistically reap idle sessions"""
+        with self.lock:
+            self._session(session_id)
+            if time.monotonic() - self.last_reap >= REAP_INTERVAL_SECONDS:
+                self.reap_idle()
+
+    def reap_idle(self):
+        """Release the blobs of every session idle past the timeout; returns their ids"""
+        with self.lock:
+            now = time.monotonic()
+            self.last_reap = now
+            idle = [
+                session_id for session_id, session in self.sessions.items()
+                if now - session['last_access'] > self.idle_timeout_seconds
+            ]
+            for session_id in idle:
+                self.release_session(session_id)
+            return idle
+
+    def release_session(self, session_id):
+        """Release all blobs held by a session"""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session:
+                for ref in session['refs']:
+                    self._drop_owner(ref, session_id)
+
+    def release(self, session_id, refs):
+        """Release one reference per ref; a blob is dropped once every put is released"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return
+            for ref in refs:
+                if ref not in session['counts']:
+                    continue
+                session['counts'][ref] -= 1
+                if session['counts'][ref] == 0:
+                    del session['counts'][ref]
+                    del session['refs'][ref]
+                    self._drop_owner(ref, session_id)
+
+    # --- Blobs ---
+
+    def put(self, session_id, data, compress=True, reserve=0):
+        """Store bytes for a session and return their ref
+
+        Already-compressed data (JPEG images) should pass compress=False.
+        Storing the same bytes again only adds a reference, which must be
+        released separately. Raises SessionBudgetExceeded if the session
+        would have less than `reserve` bytes of its budget left.
+        """
+        ref = hashlib.sha256(data).hexdigest()
+        # Compress outside the lock so sessions don't wait on each other;
+        # the result is discarded if the blob is already stored
+        stored = zlib.compress(data) if compress else data
+        with self.lock:
+            session = self._session(session_id)
+            if ref in session['refs']:
+                session['counts'][ref] += 1
+                return ref
+
+            blob = self.blobs.get(ref)
+            size = len(stored) if blob is None else blob['size']
+
+            used = sum(session['refs'].values())
+            if used + size + reserve > self.session_budget_bytes:
+                raise SessionBudgetExceeded(
+                    f"Session storage limit of {self.session_budget_bytes // (1024 * 1024)} MB exceeded"
+                )
+
+            if blob is None:
+                self.blobs[ref] = {'size': size, 'compressed': compress, 'owners': set(), 'on_disk': False}
+                self._cache(ref, stored)
+            self.blobs[ref]['owners'].add(session_id)
+            session['refs'][ref] = size
+            session['counts'][ref] = 1
+            return ref
+
+    def get(self, session_id, ref):
+        """Return the bytes for a ref held by a session; raises KeyError if it was released"""
+        with self.lock:
+            session = self._session(session_id)
+            if ref not in session['refs']:
+                raise KeyError(ref)
+
+            blob = self.blobs[ref]
+            if ref in self.memory:
+                self.memory.move_to_end(ref)
+                stored = self.memory[ref]
+            else:
+                with open(self._path(ref), 'rb') as f:
+                    stored = f.read()
+                self._cache(ref, stored)
+
+        return zlib.decompress(stored) if blob['compressed'] else stored
+
+    def _path(self, ref):
+        return os.path.join(self.spill_dir, ref)
+
+    def _cache(self, ref, stored):
+        """Put stored bytes in the memory LRU, spilling the oldest blobs to disk"""
+        self.memory[ref] = stored
+        self.memory_bytes += len(stored)
+        while self.memory_bytes > self.memory_limit_bytes and len(self.memory) > 1:
+            old_ref, old_stored = self.memory.popitem(last=False)
+            self.memory_bytes -= len(old_stored)
+            old_blob = self.blobs[old_ref]
+            if not old_blob['on_disk']:
+                with open(self._path(old_ref), 'wb') as f:
+                    f.write(old_stored)
+                old_blob['on_disk'] = True
+                self.disk_bytes += len(old_stored)
+
+    def _drop_owner(self, ref, session_id):
+        blob = self.blobs.get(ref)
+        if blob is None:
+            return
+        blob['owners'].discard(session_id)
+        if blob['owners']:
+            return
+
+        del self.blobs[ref]
+        stored = self.memory.pop(ref, None)
+        if stored is not None:
+            self.memory_bytes -= len(stored)
+        if blob['on_disk']:
+            try:
+                os.remove(self._path(ref))
+            except OSError:
+                pass
+            self.disk_bytes -= blob['size']
+
+    # --- Reporting ---
+
+    def session_bytes(self, session_id):
+        """Bytes charged to a session (shared blobs count fully for each owner)"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            return sum(session['refs'].values()) if session else 0
+
+    def stats(self):
+        """Per-session and total resident bytes"""
+        with self.lock:
+            session_bytes = {
+                session_id: sum(session['refs'].values())
+                for session_id, session in self.sessions.items()
+            }
+            return {
+                'sessions': len(self.sessions),
+                'session_bytes': session_bytes,
+                'total_session_bytes': sum(session_bytes.values()),
+                'blobs': len(self.blobs),
+                'memory_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes,
+            }
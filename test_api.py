@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+import api
+from api import ApiError, ApiService, FakeModel, FakeResponse, read_request
+from database import Database
+
+
+class CountingModel(FakeModel):
+    def __init__(self):
+        super().__init__(delay=0)
+        self.calls = 0
+
+    async def generate_content_async(self, contents, stream=False):
+        self.calls += 1
+        return await super().generate_content_async(contents, stream)
+
+
+def make_service(tmp_path):
+    db = Database(str(tmp_path / 'vault.db'))
+    db.create_user('alice', 'alice@example.com', 'secret1')
+    db.create_user('bob', 'bob@example.com', 'secret2')
+    return ApiService(db, CountingModel(), 'test-secret')
+
+
+def call(service, method, path, body=None, token=None, query=None):
+    headers = {'authorization': f'Bearer {token}'} if token else {}
+    return asyncio.run(service.dispatch(method, path, query or {}, headers, body or {}))
+
+
+def login(service, username, password):
+    return call(service, 'POST', '/auth/login', {'username': username, 'password': password})['token']
+
+
+def assert_status(status, *args, **kwargs):
+    with pytest.raises(ApiError) as error:
+        call(*args, **kwargs)
+    assert error.value.status == status
+
+
+def test_login_and_token_rejection(tmp_path):
+    service = make_service(tmp_path)
+    token = login(service, 'alice', 'secret1')
+    assert call(service, 'GET', '/vault/reports', token=token) == {'reports': []}
+
+    assert_status(401, service, 'POST', '/auth/login', {'username': 'alice', 'password': 'wrong'})
+    assert_status(400, service, 'POST', '/auth/login', {'username': 'alice', 'password': 5})
+    assert_status(401, service, 'GET', '/vault/reports')
+    assert_status(401, service, 'GET', '/vault/reports', token=token[:-1] + 'x')
+    assert_status(401, service, 'GET', '/vault/reports', token=token[:-1] + 'é')
+    assert_status(401, service, 'GET', '/vault/reports', token='not-a-token')
+
+
+def test_render_by_hash_is_cached(tmp_path):
+    service = make_service(tmp_path)
+    token = login(service, 'alice', 'secret1')
+
+    diagnosis = call(service, 'POST', '/diagnose', {'symptoms': 'fever', 'mode': 'doctor'}, token)
+    assert service.model.calls == 1
+
+    body = {'analysis_hash': diagnosis['analysis_hash'], 'language': 'hi', 'mode': 'patient'}
+    first = call(service, 'POST', '/render', body, token)
+    second = call(service, 'POST', '/render', body, token)
+    assert first['result'] == second['result']
+    assert service.model.calls == 2
+
+    # The source language/mode is returned as-is without a model call
+    same = call(service, 'POST', '/render', {**body, 'language': 'en', 'mode': 'doctor'}, token)
+    assert same['result'] == diagnosis['result']
+    assert service.model.calls == 2
+
+
+def test_render_patient_analysis_as_doctor_is_rejected(tmp_path):
+    service = make_service(tmp_path)
+    token = login(service, 'alice', 'secret1')
+
+    diagnosis = call(service, 'POST', '/diagnose', {'symptoms': 'fever'}, token)
+    body = {'analysis_hash': diagnosis['analysis_hash'], 'mode': 'doctor'}
+    assert_status(409, service, 'POST', '/render', body, token)
+    assert_status(404, service, 'POST', '/render', {'analysis_hash': 'unknown'}, token)
+
+
+def test_stalled_stream_releases_its_model_slot(tmp_path, monkeypatch):
+    class StallingModel(FakeModel):
+        async def generate_content_async(self, contents, stream=False):
+            async def chunks():
+                yield FakeResponse('partial')
+                await asyncio.sleep(60)
+            return chunks()
+
+    monkeypatch.setattr(api, 'MODEL_TIMEOUT_SECONDS', 0.05)
+    service = ApiService(Database(str(tmp_path / 'vault.db')), StallingModel(), 'test-secret', 1)
+
+    async def run():
+        return [text async for text in service.generate_stream('prompt')], service.model_slots.locked()
+
+    chunks, locked = asyncio.run(run())
+    assert chunks == ['partial', '\n\nError during analysis: model call timed out']
+    assert not locked
+
+
+def test_vault_reports_belong_to_their_owner(tmp_path):
+    service = make_service(tmp_path)
+    service.db.save_report(1, 'General', 'fever', 'Flu')
+    alice = login(service, 'alice', 'secret1')
+    bob = login(service, 'bob', 'secret2')
+
+    [report] = call(service, 'GET', '/vault/reports', token=alice)['reports']
+    assert report['diagnosis'] == 'Flu'
+    assert call(service, 'GET', '/vault/reports', token=bob) == {'reports': []}
+
+    assert_status(404, service, 'GET', f"/vault/reports/{report['id']}", token=bob)
+    assert_status(404, service, 'DELETE', f"/vault/reports/{report['id']}", token=bob)
+    assert call(service, 'GET', f"/vault/reports/{report['id']}", token=alice)['symptoms'] == 'fever'
+
+    assert call(service, 'DELETE', f"/vault/reports/{report['id']}", token=alice) == {'deleted': report['id']}
+    assert_status(404, service, 'GET', f"/vault/reports/{report['id']}", token=alice)
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'symptoms': 5},
+    {'symptoms': 'fever', 'follow_up_answers': ['yes']},
+    {'symptoms': 'fever', 'follow_up_answers': {'Since when?': 3}},
+    {'symptoms': 'fever', 'language': 'fr'},
+    {'symptoms': 'fever', 'images': 'abc'},
+    {'symptoms': 'fever', 'images': [{'name': 'x.png'}]},
+    {'symptoms': 'fever', 'lab_reports': [{'name': 'lab.pdf', 'data': '###'}]},
+])
+def test_invalid_diagnosis_requests(tmp_path, body):
+    service = make_service(tmp_path)
+    token = login(service, 'alice', 'secret1')
+    assert_status(400, service, 'POST', '/diagnose', body, token)
+    assert service.model.calls == 0
+
+
+def read(raw, limit=2 ** 16):
+    async def run():
+        reader = asyncio.StreamReader(limit=limit)
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_request(reader)
+    return asyncio.run(run())
+
+
+def test_read_request():
+    method, target, headers, body = read(b'post /diagnose HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}')
+    assert (method, target, headers, body) == ('POST', '/diagnose', {'content-length': '2'}, b'{}')
+
+
+@pytest.mark.parametrize('raw, status', [
+    (b'GET / HTTP/1.1\r\nContent-Length: abc\r\n\r\n', 400),
+    (b'GET / HTTP/1.1\r\nContent-Length: -1\r\n\r\n', 400),
+    (b'GARBAGE\r\n\r\n', 400),
+    (b'GET / HTTP/1.1\r\nX-Long: ' + b'a' * 1024 + b'\r\n\r\n', 431),
+])
+def test_read_request_rejects_malformed_requests(raw, status):
+    with pytest.raises(ApiError) as error:
+        read(raw, limit=256)
+    assert error.value.status == status
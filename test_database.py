@@ -0,0 +1,100 @@
+import sqlite3
+
+from database import Database, STUB_SYMPTOMS_LENGTH
+
+
+def make_db(tmp_path):
+    db = Database(str(tmp_path / 'vault.db'))
+    db.create_user('alice', 'alice@example.com', 'secret1')
+    return db
+
+
+def age_report(db, report_id, days):
+    conn = sqlite3.connect(db.db_name)
+    conn.execute(
+        "UPDATE health_reports SET created_at = datetime('now', ?) WHERE id = ?",
+        (f'-{days} days', report_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_archived_report_loads_back_in_full(tmp_path):
+    db = make_db(tmp_path)
+    symptoms = 'persistent cough ' * 40
+    diagnosis = 'Likely bronchitis. ' * 500
+    db.save_report(1, 'General', symptoms, diagnosis)
+    db.save_report(1, 'General', 'recent headache', 'Tension headache')
+    age_report(db, 1, 400)
+
+    assert db.archive_old_reports(retention_days=365) == 1
+
+    # The hot table only keeps a stub for the old report
+    old, recent = sorted(db.get_user_reports(1))
+    assert old[4] is None
+    assert len(old[3]) == STUB_SYMPTOMS_LENGTH
+    assert recent[4] == 'Tension headache'
+
+    report = db.get_report_by_id(1, 1)
+    assert report[3] == symptoms
+    assert report[4] == diagnosis
+    assert db.get_report_by_id(1, 2) is None
+
+
+def test_new_databases_use_incremental_vacuum(tmp_path):
+    db = make_db(tmp_path)
+
+    for path in (db.db_name, db.archive_name):
+        conn = sqlite3.connect(path)
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        conn.close()
+
+
+def test_delete_report_removes_archive_row(tmp_path):
+    db = make_db(tmp_path)
+    db.save_report(1, 'General', 'old symptoms', 'old diagnosis')
+    age_report(db, 1, 400)
+    db.archive_old_reports(retention_days=365)
+
+    db.delete_report(1, 1)
+
+    assert db.get_report_by_id(1, 1) is None
+    archive = sqlite3.connect(db.archive_name)
+    assert archive.execute('SELECT COUNT(*) FROM health_reports').fetchone()[0] == 0
+    archive.close()
+
+
+def test_archived_column_added_to_old_schema(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE health_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            symptoms TEXT NOT NULL,
+            diagnosis TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute(
+        "INSERT INTO health_reports (user_id, category, symptoms, diagnosis) VALUES (1, 'General', 'fever', 'Flu')"
+    )
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+
+    conn = sqlite3.connect(path)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(health_reports)')]
+    assert 'archived' in columns
+    # Opening the database never VACUUMs it; background maintenance does
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    conn.close()
+
+    db.run_maintenance()
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    conn.close()
+    [report] = db.get_user_reports(1)
+    assert report[:5] == (1, 1, 'General', 'fever', 'Flu')
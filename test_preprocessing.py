@@ -0,0 +1,75 @@
+import io
+
+import pytest
+
+pytest.importorskip('PIL')
+pytest.importorskip('PyPDF2')
+
+from PIL import Image, ImageDraw
+
+from preprocessing import encoded_size, pack_payload, preprocess_image, preprocess_uploads
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def radiograph(lesion=False):
+    image = Image.new('L', (256, 256), 40)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((48, 32, 208, 224), fill=160)
+    if lesion:
+        draw.ellipse((90, 90, 150, 150), fill=250)
+    return png_bytes(image)
+
+
+def test_16bit_grayscale_is_rescaled_not_clipped():
+    # 12-bit values as exported from DICOM: dark background, brighter body
+    image = Image.new('I;16', (64, 64), 1000)
+    image.paste(Image.new('I;16', (32, 64), 4000), (32, 0))
+
+    result = preprocess_image('scan.png', png_bytes(image))
+
+    decoded = Image.open(io.BytesIO(result['data'])).convert('L')
+    left, right = decoded.getpixel((8, 32)), decoded.getpixel((56, 32))
+    assert right >= 250
+    assert 50 <= left <= 75
+
+
+def test_corrupt_pdf_is_an_error_entry():
+    result = preprocess_uploads([], [('lab.pdf', b'not a pdf')])
+
+    assert result['pdfs'] == []
+    [(name, error)] = result['errors']
+    assert name == 'lab.pdf' and error.startswith('Error reading PDF')
+    assert result['timings'][0]['error']
+
+
+def test_only_near_identical_images_are_flagged():
+    scan = radiograph()
+    result = preprocess_uploads(
+        [('before.png', scan), ('copy.png', scan), ('after.png', radiograph(lesion=True))], []
+    )
+
+    assert result['duplicates'] == [('copy.png', 'before.png')]
+    assert [image['name'] for image in result['images']] == ['before.png', 'copy.png', 'after.png']
+
+    _, parts, _ = pack_payload(result, 'symptoms')
+    assert len(parts) == 2
+    _, parts, _ = pack_payload(result, 'symptoms', keep_duplicates=['copy.png'])
+    assert len(parts) == 3
+
+
+def test_payload_budget_counts_base64_size():
+    image = {'name': 'scan.jpg', 'mime_type': 'image/jpeg', 'data': b'x' * 3000, 'size': (400, 400)}
+    prepared = {'images': [image], 'pdfs': []}
+    text = 'symptoms'
+
+    # Fits raw but not base64-encoded, and can't be shrunk below MIN_IMAGE_SIDE
+    budget = len(text) + 3500
+    assert encoded_size(3000) == 4000
+    _, parts, notes = pack_payload(prepared, text, budget=budget)
+    assert parts == []
+    assert notes == ['scan.jpg was left out to fit the request size limit']